@@ -0,0 +1,140 @@
+# benchmark_sharding.py
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import bcrypt
+
+from moschitta_auth.sharded_authenticator import ShardedAuthenticator
+
+
+def _write_users(db_paths, usernames, hashed_password, start, results):
+    """Insert users from a worker process once every worker is ready."""
+    authenticator = ShardedAuthenticator(db_paths=db_paths, pool_size=1)
+    start.wait()
+    started = time.monotonic()
+    for username in usernames:
+        authenticator.import_user(username, hashed_password)
+    finished = time.monotonic()
+    authenticator.close()
+    results.put((len(usernames), started, finished))
+
+
+def benchmark_threads(shard_count: int, users: int = 2000, threads: int = 8):
+    """
+    Measure write throughput of one sharded store driven by several threads.
+
+    Every thread writes an unsorted mix of usernames through the same
+    ShardedAuthenticator, so this exercises its routing and connection
+    pools the way an application server would.
+
+    Args:
+        shard_count (int): Number of shard databases to spread users across.
+        users (int, optional): Number of users to insert. Defaults to 2000.
+        threads (int, optional): Number of writer threads. Defaults to 8.
+
+    Returns:
+        tuple: Total users written per second, and a list of the commits per
+        second each shard sustained.
+    """
+    hashed_password = bcrypt.hashpw(b"password", bcrypt.gensalt(4)).decode()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_paths = [os.path.join(tmp_dir, f"shard_{i}.db") for i in range(shard_count)]
+        authenticator = ShardedAuthenticator(db_paths=db_paths, pool_size=threads)
+
+        def write(start: int) -> None:
+            for i in range(start, users, threads):
+                authenticator.import_user(f"user_{i}", hashed_password)
+
+        workers = [threading.Thread(target=write, args=(i,)) for i in range(threads)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+        counts = {name: 0 for name in authenticator.shards}
+        for user in authenticator.list_users():
+            counts[user["shard"]] += 1
+        authenticator.close()
+    return users / elapsed, [count / elapsed for count in counts.values()]
+
+
+def benchmark_sharding(shard_count: int, users: int = 2000):
+    """
+    Measure user write throughput for a sharded user store.
+
+    One worker process is started per shard and writes only the users that
+    shard owns, so shards are written in parallel without sharing the GIL.
+    This shows the ceiling the shards themselves allow; benchmark_threads
+    measures a single instance. Passwords are hashed once up front so the
+    benchmark measures the database commits rather than bcrypt.
+
+    Args:
+        shard_count (int): Number of shard databases to spread users across.
+        users (int, optional): Number of users to insert. Defaults to 2000.
+
+    Returns:
+        tuple: Total users written per second, and a list of the commits per
+        second each shard sustained.
+    """
+    hashed_password = bcrypt.hashpw(b"password", bcrypt.gensalt(4)).decode()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_paths = [os.path.join(tmp_dir, f"shard_{i}.db") for i in range(shard_count)]
+        authenticator = ShardedAuthenticator(db_paths=db_paths, pool_size=1)
+        partitions = {name: [] for name in authenticator.shards}
+        for i in range(users):
+            username = f"user_{i}"
+            partitions[authenticator.shard_for(username)].append(username)
+        authenticator.close()
+
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=_write_users,
+                args=(db_paths, usernames, hashed_password, start, results),
+            )
+            for usernames in partitions.values()
+        ]
+        for worker in workers:
+            worker.start()
+        start.set()
+        timings = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+    elapsed = max(t[2] for t in timings) - min(t[1] for t in timings)
+    per_shard = [count / (finished - started) for count, started, finished in timings]
+    return users / elapsed, per_shard
+
+
+def main():
+    """
+    Parse command-line arguments and run the benchmark for each shard count.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark sharded user writes.")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="Shard counts to benchmark (default: 1 2 4 8)")
+    parser.add_argument("--users", type=int, default=2000, help="Users to insert per run (default: 2000)")
+    parser.add_argument("--mode", default="processes", choices=["processes", "threads"], help="One process per shard, or one instance driven by threads (default: processes)")
+    parser.add_argument("--threads", type=int, default=8, help="Writer threads in threads mode (default: 8)")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs available")
+    baseline = None
+    for shard_count in args.shards:
+        if args.mode == "threads":
+            throughput, per_shard = benchmark_threads(shard_count, args.users, args.threads)
+        else:
+            throughput, per_shard = benchmark_sharding(shard_count, args.users)
+        baseline = baseline or throughput
+        commits = ", ".join(f"{rate:,.0f}" for rate in per_shard)
+        print(f"{shard_count} shards: {throughput:,.0f} writes/s ({throughput / baseline:.2f}x), per-shard commits/s: {commits}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+# moschitta_auth/sharded_authenticator.py
+
+import bisect
+import hashlib
+import os
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Union
+
+import bcrypt
+
+
+class ShardedAuthenticator:
+    """Authentication class that spreads users across several SQLite databases.
+
+    Users are placed on a shard by consistently hashing their tenant ID (or
+    their username when no tenant ID is given), so adding a shard only moves
+    the users that hash onto it. Every shard has its own connection pool and
+    its own writer lock, which lets writes to different shards run in parallel.
+
+    Shards are identified on the hash ring by name. Pass a ``{name: path}``
+    mapping to choose stable names, or a list of paths to name each shard by
+    its resolved absolute path. Every process sharing a store must use the
+    same shard names, otherwise they will disagree on where users live.
+    """
+
+    def __init__(
+        self,
+        db_paths: Union[List[str], Dict[str, str]],
+        pool_size: int = 4,
+        virtual_nodes: int = 64,
+        timeout: float = 5.0,
+    ):
+        if not db_paths:
+            raise ValueError("At least one shard database path is required.")
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1.")
+        if virtual_nodes < 1:
+            raise ValueError("virtual_nodes must be at least 1.")
+        self.pool_size = pool_size
+        self.virtual_nodes = virtual_nodes
+        self.timeout = timeout
+        self.shards: Dict[str, str] = {}
+        self._pools: Dict[str, queue.Queue] = {}
+        self._closed = False
+        # The other ring a running add_shard/remove_shard routes logouts to
+        self._moving_ring: Optional[List[tuple]] = None
+        if not isinstance(db_paths, dict):
+            db_paths = {self._shard_name(db_path): db_path for db_path in db_paths}
+        for name, db_path in db_paths.items():
+            self._open_shard(name, db_path)
+            self.shards[name] = db_path
+        self._ring = self._build_ring(list(self.shards))
+
+    @staticmethod
+    def _shard_name(db_path: str) -> str:
+        return os.path.realpath(db_path)
+
+    def _open_shard(self, name: str, db_path: str) -> None:
+        if name in self._pools:
+            raise ValueError(f"Shard already registered: {name}")
+        pool: queue.Queue = queue.Queue(maxsize=self.pool_size)
+        for _ in range(self.pool_size):
+            pool.put(self._connect(db_path))
+        self._pools[name] = pool
+        # Create necessary tables if they do not exist
+        self._create_tables(name)
+
+    def _connect(self, db_path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(db_path, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _create_tables(self, name: str) -> None:
+        with self._connection(name) as conn:
+            conn.execute("BEGIN")
+            c = conn.cursor()
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS users
+                         (username TEXT, hashed_password TEXT,
+                          tenant_id TEXT NOT NULL DEFAULT '',
+                          PRIMARY KEY (tenant_id, username))"""
+            )
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS sessions
+                         (session_id TEXT PRIMARY KEY, username TEXT,
+                          tenant_id TEXT NOT NULL DEFAULT '')"""
+            )
+            self._upgrade_legacy_tables(c)
+            conn.commit()
+
+    def _upgrade_legacy_tables(self, c: sqlite3.Cursor) -> None:
+        # Databases created for BasicAuthenticator key users by username alone
+        # and have no tenant_id column, so rebuild them with the sharded schema
+        users = {row[1]: row[5] for row in c.execute("PRAGMA table_info(users)")}
+        if not users.get("tenant_id"):
+            tenant = "COALESCE(tenant_id, '')" if "tenant_id" in users else "''"
+            c.execute("ALTER TABLE users RENAME TO legacy_users")
+            c.execute(
+                """CREATE TABLE users
+                         (username TEXT, hashed_password TEXT,
+                          tenant_id TEXT NOT NULL DEFAULT '',
+                          PRIMARY KEY (tenant_id, username))"""
+            )
+            c.execute(
+                f"""INSERT INTO users (username, hashed_password, tenant_id)
+                    SELECT username, hashed_password, {tenant} FROM legacy_users"""
+            )
+            c.execute("DROP TABLE legacy_users")
+        sessions = {row[1] for row in c.execute("PRAGMA table_info(sessions)")}
+        if "username" not in sessions:
+            c.execute("ALTER TABLE sessions ADD COLUMN username TEXT")
+        if "tenant_id" not in sessions:
+            c.execute(
+                "ALTER TABLE sessions ADD COLUMN tenant_id TEXT NOT NULL DEFAULT ''"
+            )
+
+    @contextmanager
+    def _connection(self, name: str) -> Iterator[sqlite3.Connection]:
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed authenticator.")
+        pool = self._pools[name]
+        try:
+            conn = pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Timed out waiting for a connection to shard: {name}"
+            ) from None
+        try:
+            yield conn
+        except BaseException:
+            # Never hand a connection back with an open transaction, it would
+            # keep holding the shard's writer lock
+            conn.rollback()
+            raise
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                pool.put(conn)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode(), usedforsecurity=False).digest()[:8], "big")
+
+    def _build_ring(self, names: List[str]) -> List[tuple]:
+        return sorted(
+            (self._hash(f"{name}#{replica}"), name)
+            for name in names
+            for replica in range(self.virtual_nodes)
+        )
+
+    def _owner(self, ring: List[tuple], username: str, tenant_id: str) -> str:
+        key = tenant_id or username
+        index = bisect.bisect(ring, (self._hash(key),))
+        if index == len(ring):
+            index = 0
+        return ring[index][1]
+
+    def shard_for(self, username: str, tenant_id: Optional[str] = None) -> str:
+        """Return the name of the shard that owns the given user or tenant."""
+        return self._owner(self._ring, username, tenant_id or "")
+
+    def _scatter(self, func) -> list:
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            return list(executor.map(func, list(self.shards)))
+
+    def _hash_password(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+    def import_user(
+        self, username: str, hashed_password: str, tenant_id: Optional[str] = None
+    ) -> None:
+        """Store a user whose password has already been hashed with bcrypt."""
+        with self._connection(self.shard_for(username, tenant_id)) as conn:
+            conn.execute(
+                "INSERT INTO users (username, hashed_password, tenant_id) VALUES (?, ?, ?)",
+                (username, hashed_password, tenant_id or ""),
+            )
+            conn.commit()
+
+    def register_user(
+        self, username: str, password: str, tenant_id: Optional[str] = None
+    ) -> None:
+        hashed_password = self._hash_password(password)
+        self.import_user(username, hashed_password, tenant_id)
+
+    def authenticate(
+        self, username: str, password: str, tenant_id: Optional[str] = None
+    ) -> Optional[dict]:
+        with self._connection(self.shard_for(username, tenant_id)) as conn:
+            c = conn.cursor()
+            c.execute(
+                "SELECT hashed_password FROM users WHERE username = ? AND tenant_id = ?",
+                (username, tenant_id or ""),
+            )
+            result = c.fetchone()
+        if result:
+            hashed_password = result[0]
+            if bcrypt.checkpw(password.encode(), hashed_password.encode()):
+                user = {"username": username}
+                if tenant_id:
+                    user["tenant_id"] = tenant_id
+                return user
+        return None
+
+    def authorize(self, user: dict, permissions: list) -> bool:
+        # Same placeholder authorization logic as BasicAuthenticator
+        if "admin" in permissions:
+            return True
+        else:
+            return False
+
+    def logout(
+        self,
+        session_id: str,
+        username: Optional[str] = None,
+        tenant_id: Optional[str] = None,
+    ) -> None:
+        """Logout the user.
+
+        When the tenant ID is known, or the username belongs to a user without
+        a tenant, the session is deleted on the owning shard only. Otherwise
+        the delete is sent to every shard, since a username alone does not
+        locate a user registered under a tenant.
+        """
+
+        def delete(name: str) -> None:
+            with self._connection(name) as conn:
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                conn.commit()
+
+        moving = self._moving_ring is not None
+        if username is None and tenant_id is None:
+            names = list(self.shards)
+        else:
+            names = self._owners(username or "", tenant_id or "")
+            if tenant_id is None and not any(
+                self._has_user(name, username, "") for name in names
+            ):
+                names = list(self.shards)
+        # While a move runs the session may be copied between the passes, the
+        # copy holds the source shard's write lock so the second pass sees it
+        for _ in range(2 if moving else 1):
+            for name in names:
+                delete(name)
+
+    def _owners(self, username: str, tenant_id: str) -> List[str]:
+        names = [self._owner(self._ring, username, tenant_id)]
+        moving_ring = self._moving_ring
+        if moving_ring is not None:
+            other = self._owner(moving_ring, username, tenant_id)
+            if other not in names:
+                names.append(other)
+        return names
+
+    def _has_user(self, name: str, username: str, tenant_id: str) -> bool:
+        with self._connection(name) as conn:
+            return (
+                conn.execute(
+                    "SELECT 1 FROM users WHERE username = ? AND tenant_id = ?",
+                    (username, tenant_id),
+                ).fetchone()
+                is not None
+            )
+
+    def list_users(self, tenant_id: Optional[str] = None) -> List[dict]:
+        """Return all users across every shard, optionally filtered by tenant."""
+
+        def fetch(name: str) -> list:
+            with self._connection(name) as conn:
+                c = conn.cursor()
+                if tenant_id:
+                    c.execute(
+                        "SELECT username, tenant_id FROM users WHERE tenant_id = ?",
+                        (tenant_id,),
+                    )
+                else:
+                    c.execute("SELECT username, tenant_id FROM users")
+                return [
+                    {"username": username, "tenant_id": tenant or None, "shard": name}
+                    for username, tenant in c.fetchall()
+                ]
+
+        if tenant_id:
+            return fetch(self.shard_for("", tenant_id))
+        return [user for users in self._scatter(fetch) for user in users]
+
+    def __len__(self) -> int:
+        def count(name: str) -> int:
+            with self._connection(name) as conn:
+                return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+        return sum(self._scatter(count))
+
+    def add_shard(
+        self, db_path: str, name: Optional[str] = None, rebalance: bool = True
+    ) -> int:
+        """Add a shard to the ring and optionally move the users it now owns.
+
+        Users are copied onto the new shard before it takes ownership of them,
+        and logouts go to both the old and new owner until the move finishes,
+        so this instance keeps working while the move runs. Admin queries may
+        count a moving user twice until then. Other processes using the store
+        are not told about the new shard and must be stopped until they are
+        restarted with the new shard list.
+
+        Returns:
+            int: The number of users moved.
+        """
+        name = name or self._shard_name(db_path)
+        self._open_shard(name, db_path)
+        sources = list(self.shards)
+        self.shards[name] = db_path
+        ring = self._build_ring(list(self.shards))
+        if not rebalance:
+            self._ring = ring
+            return 0
+        try:
+            return self._reshard(ring, sources)
+        except Exception:
+            if self._ring is not ring:
+                del self.shards[name]
+                self._close_pool(self._pools.pop(name))
+            raise
+
+    def remove_shard(self, name: str) -> int:
+        """Move every user off a shard and remove it from the ring.
+
+        The shard's database file is left in place. The same caveats as
+        add_shard apply to other processes using the store.
+
+        Returns:
+            int: The number of users moved.
+        """
+        if name not in self.shards:
+            raise ValueError(f"Shard not registered: {name}")
+        if len(self.shards) == 1:
+            raise ValueError("Cannot remove the last shard.")
+        ring = self._build_ring([other for other in self.shards if other != name])
+        moved = self._reshard(ring, [name])
+        del self.shards[name]
+        self._close_pool(self._pools.pop(name))
+        return moved
+
+    def _reshard(self, ring: List[tuple], sources: List[str]) -> int:
+        old_ring = self._ring
+        self._moving_ring = ring
+        try:
+            copied = []
+            try:
+                for source in sources:
+                    for username, hashed_password, tenant_id in self._users_on(source):
+                        target = self._owner(ring, username, tenant_id)
+                        if target != source:
+                            self._copy_user(
+                                source, target, username, hashed_password, tenant_id
+                            )
+                            copied.append((source, target, username, tenant_id))
+            except Exception:
+                # The sources still own every copied user, drop the copies
+                for _, target, username, tenant_id in copied:
+                    self._delete_user(target, username, tenant_id)
+                raise
+            self._ring = ring
+            self._moving_ring = old_ring
+            for source, _, username, tenant_id in copied:
+                self._delete_user(source, username, tenant_id)
+            # Catch users registered on their old shard while the copy ran
+            return len(copied) + self.rebalance()
+        finally:
+            self._moving_ring = None
+
+    def rebalance(self) -> int:
+        """Move every user (and their sessions) onto the shard that owns them.
+
+        Moves can be resumed: a user already on its owning shard with the
+        same password hash is treated as copied and removed from the other
+        shard. A user with a different hash is never overwritten, the move
+        fails with sqlite3.IntegrityError instead. Run this while the store
+        is idle, logouts during the move only reach the owning shard.
+
+        Returns:
+            int: The number of users moved.
+        """
+        moved = 0
+        for source in list(self.shards):
+            for username, hashed_password, tenant_id in self._users_on(source):
+                target = self._owner(self._ring, username, tenant_id)
+                if target != source:
+                    self._copy_user(source, target, username, hashed_password, tenant_id)
+                    self._delete_user(source, username, tenant_id)
+                    moved += 1
+        return moved
+
+    def _users_on(self, name: str) -> list:
+        with self._connection(name) as conn:
+            return conn.execute(
+                "SELECT username, hashed_password, tenant_id FROM users"
+            ).fetchall()
+
+    def _copy_user(
+        self,
+        source: str,
+        target: str,
+        username: str,
+        hashed_password: str,
+        tenant_id: str,
+    ) -> None:
+        with self._connection(source) as src, self._connection(target) as conn:
+            # Hold the source's write lock until the copy commits, so a logout
+            # cannot delete a session between reading and copying it
+            src.execute("BEGIN IMMEDIATE")
+            sessions = src.execute(
+                "SELECT session_id, username, tenant_id FROM sessions WHERE username = ? AND tenant_id = ?",
+                (username, tenant_id),
+            ).fetchall()
+            existing = conn.execute(
+                "SELECT hashed_password FROM users WHERE username = ? AND tenant_id = ?",
+                (username, tenant_id),
+            ).fetchone()
+            if existing is None:
+                conn.execute(
+                    "INSERT INTO users (username, hashed_password, tenant_id) VALUES (?, ?, ?)",
+                    (username, hashed_password, tenant_id),
+                )
+            elif existing[0] != hashed_password:
+                raise sqlite3.IntegrityError(
+                    f"User {username!r} of tenant {tenant_id!r} already exists on shard {target} with a different password."
+                )
+            for session in sessions:
+                existing = conn.execute(
+                    "SELECT session_id, username, tenant_id FROM sessions WHERE session_id = ?",
+                    (session[0],),
+                ).fetchone()
+                if existing is None:
+                    conn.execute(
+                        "INSERT INTO sessions (session_id, username, tenant_id) VALUES (?, ?, ?)",
+                        session,
+                    )
+                elif existing != session:
+                    raise sqlite3.IntegrityError(
+                        f"Session {session[0]!r} already exists on shard {target} for another user."
+                    )
+            conn.commit()
+            src.rollback()
+
+    def _delete_user(self, name: str, username: str, tenant_id: str) -> None:
+        with self._connection(name) as conn:
+            conn.execute(
+                "DELETE FROM sessions WHERE username = ? AND tenant_id = ?",
+                (username, tenant_id),
+            )
+            conn.execute(
+                "DELETE FROM users WHERE username = ? AND tenant_id = ?",
+                (username, tenant_id),
+            )
+            conn.commit()
+
+    @staticmethod
+    def _close_pool(pool: queue.Queue) -> None:
+        while not pool.empty():
+            pool.get_nowait().close()
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        self._closed = True
+        for pool in self._pools.values():
+            self._close_pool(pool)
@@ -0,0 +1,69 @@
+# rebalance_shards.py
+
+import argparse
+
+from moschitta_auth.sharded_authenticator import ShardedAuthenticator
+
+
+def parse_shards(values):
+    """
+    Parse shard arguments of the form ``name=path`` or ``path``.
+
+    Args:
+        values (list): Shard arguments from the command line.
+
+    Returns:
+        dict: Shard names mapped to database paths. Shards given without a
+        name are named by their resolved absolute path.
+    """
+    shards = {}
+    for value in values:
+        name, sep, path = value.partition("=")
+        if not sep:
+            name, path = ShardedAuthenticator._shard_name(value), value
+        shards[name] = path
+    return shards
+
+
+def rebalance_shards(shards, new_shards=()):
+    """
+    Add new shards to a sharded user store and move users onto their owning shard.
+
+    Every other process using the store must be stopped while this runs and
+    restarted with the new shard list afterwards. Existing BasicAuthenticator
+    databases are upgraded to the sharded schema.
+
+    Args:
+        shards (list or dict): Existing shard database paths, or names mapped to paths.
+        new_shards (list or dict, optional): Shard databases being added, in the same form.
+
+    Returns:
+        int: The number of users moved.
+    """
+    if not isinstance(new_shards, dict):
+        new_shards = {ShardedAuthenticator._shard_name(path): path for path in new_shards}
+    authenticator = ShardedAuthenticator(db_paths=shards)
+    try:
+        moved = authenticator.rebalance()
+        for name, db_path in new_shards.items():
+            moved += authenticator.add_shard(db_path, name=name)
+        return moved
+    finally:
+        authenticator.close()
+
+
+def main():
+    """
+    Parse command-line arguments and rebalance the shards accordingly.
+    """
+    parser = argparse.ArgumentParser(description="Rebalance a sharded user store. Stop every application process first.")
+    parser.add_argument("--shard", action="append", required=True, help="Existing shard as name=path or path (repeatable)")
+    parser.add_argument("--add-shard", action="append", default=[], help="Shard to add as name=path or path (repeatable)")
+    args = parser.parse_args()
+
+    moved = rebalance_shards(parse_shards(args.shard), parse_shards(args.add_shard))
+    print(f"Moved {moved} users across {len(args.shard) + len(args.add_shard)} shards")
+
+
+if __name__ == "__main__":
+    main()
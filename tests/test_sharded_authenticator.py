@@ -0,0 +1,350 @@
+# tests/test_sharded_authenticator.py
+
+import sqlite3
+import threading
+
+import bcrypt
+import pytest
+
+from moschitta_auth.sharded_authenticator import ShardedAuthenticator
+from rebalance_shards import parse_shards, rebalance_shards
+
+HASHED_PASSWORD = bcrypt.hashpw(b"example_password", bcrypt.gensalt(4)).decode()
+
+
+@pytest.fixture
+def shard_paths(tmp_path):
+    """Fixture to provide paths to temporary shard databases for testing."""
+    return [str(tmp_path / f"shard_{i}.db") for i in range(3)]
+
+
+@pytest.fixture
+def authenticator(shard_paths):
+    """Fixture to create a ShardedAuthenticator instance for testing."""
+    authenticator = ShardedAuthenticator(db_paths=shard_paths, timeout=1.0)
+    yield authenticator
+    authenticator.close()
+
+
+def _users_in(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return set(conn.execute("SELECT tenant_id, username FROM users"))
+    finally:
+        conn.close()
+
+
+def _usernames_in(db_path):
+    return {username for _, username in _users_in(db_path)}
+
+
+def _sessions_in(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {row[0] for row in conn.execute("SELECT session_id FROM sessions")}
+    finally:
+        conn.close()
+
+
+def _insert_rows(db_path, sql, rows):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany(sql, rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _tenants_on_same_shard(authenticator):
+    """Return two tenant IDs that hash to the same shard."""
+    first = authenticator.shard_for("", "t0")
+    for i in range(1, 1000):
+        if authenticator.shard_for("", f"t{i}") == first:
+            return "t0", f"t{i}"
+
+
+def test_requires_a_shard():
+    """Test that at least one shard path must be given."""
+    with pytest.raises(ValueError):
+        ShardedAuthenticator(db_paths=[])
+
+
+def test_requires_a_positive_pool_size(shard_paths):
+    """Test that an empty connection pool is rejected."""
+    with pytest.raises(ValueError):
+        ShardedAuthenticator(db_paths=shard_paths, pool_size=0)
+    with pytest.raises(ValueError):
+        ShardedAuthenticator(db_paths=shard_paths, virtual_nodes=0)
+
+
+def test_closed_authenticator_raises(authenticator):
+    """Test that calls after close() raise instead of blocking."""
+    authenticator.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        authenticator.authenticate("example_user", "example_password")
+
+
+def test_authentication_success(authenticator):
+    """Test successful authentication against the owning shard."""
+    authenticator.register_user("example_user", "example_password")
+    assert authenticator.authenticate("example_user", "example_password") == {
+        "username": "example_user"
+    }
+    shard = authenticator.shards[authenticator.shard_for("example_user")]
+    assert "example_user" in _usernames_in(shard)
+
+
+def test_authentication_failure(authenticator):
+    """Test authentication failure with wrong password or non-existent user."""
+    authenticator.import_user("example_user", HASHED_PASSWORD)
+    assert authenticator.authenticate("example_user", "wrong_password") is None
+    assert authenticator.authenticate("nonexistent_user", "example_password") is None
+
+
+def test_failed_write_releases_shard(authenticator):
+    """Test that a failed write does not keep the shard's writer lock."""
+    authenticator.import_user("example_user", HASHED_PASSWORD)
+    with pytest.raises(sqlite3.IntegrityError):
+        authenticator.import_user("example_user", HASHED_PASSWORD)
+    shard = authenticator.shard_for("example_user")
+    for i in range(100):
+        if authenticator.shard_for(f"user_{i}") == shard:
+            authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+            break
+    assert len(authenticator) == 2
+
+
+def test_tenants_are_isolated(authenticator):
+    """Test that a user can only authenticate under their own tenant."""
+    tenant_a, tenant_b = _tenants_on_same_shard(authenticator)
+    authenticator.import_user("john", HASHED_PASSWORD, tenant_id=tenant_a)
+    assert authenticator.authenticate("john", "example_password", tenant_a)
+    assert authenticator.authenticate("john", "example_password", tenant_b) is None
+    assert authenticator.authenticate("john", "example_password") is None
+
+    authenticator.import_user("john", HASHED_PASSWORD, tenant_id=tenant_b)
+    assert len(authenticator.list_users(tenant_id=tenant_b)) == 1
+
+
+def test_tenant_users_share_a_shard(authenticator):
+    """Test that every user of a tenant is stored on the tenant's shard."""
+    for i in range(10):
+        authenticator.import_user(f"user_{i}", HASHED_PASSWORD, tenant_id="acme")
+    shard = authenticator.shards[authenticator.shard_for("", "acme")]
+    assert len(_usernames_in(shard)) == 10
+    assert len(authenticator.list_users(tenant_id="acme")) == 10
+
+
+def test_users_spread_across_shards(authenticator, shard_paths):
+    """Test that users are spread over every shard and gathered by admin queries."""
+    for i in range(100):
+        authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+    assert all(_usernames_in(db_path) for db_path in shard_paths)
+    assert len(authenticator) == 100
+    assert {user["username"] for user in authenticator.list_users()} == {
+        f"user_{i}" for i in range(100)
+    }
+
+
+def test_concurrent_writes(authenticator):
+    """Test that writes from many threads all land on their shards."""
+
+    def write(start):
+        for i in range(start, 200, 8):
+            authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+
+    workers = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(authenticator) == 200
+
+
+def test_logout(authenticator):
+    """Test that logout removes the session from the owning shard or any shard."""
+    authenticator.import_user("example_user", HASHED_PASSWORD)
+    shard = authenticator.shards[authenticator.shard_for("example_user")]
+    _insert_rows(
+        shard,
+        "INSERT INTO sessions (session_id, username) VALUES (?, ?)",
+        [("session_1", "example_user"), ("session_2", "example_user")],
+    )
+    authenticator.logout("session_1", username="example_user")
+    authenticator.logout("session_2")
+    assert _sessions_in(shard) == set()
+
+
+def test_logout_tenant_user_by_username(authenticator):
+    """Test that a username alone still finds a session of a tenant user."""
+    for i in range(100):
+        tenant_id = f"t{i}"
+        if authenticator.shard_for("", tenant_id) != authenticator.shard_for("john"):
+            break
+    authenticator.import_user("john", HASHED_PASSWORD, tenant_id=tenant_id)
+    shard = authenticator.shards[authenticator.shard_for("", tenant_id)]
+    _insert_rows(
+        shard,
+        "INSERT INTO sessions (session_id, username, tenant_id) VALUES (?, ?, ?)",
+        [("session_1", "john", tenant_id)],
+    )
+    authenticator.logout("session_1", username="john")
+    assert _sessions_in(shard) == set()
+
+
+def test_add_shard_rebalances_users(authenticator, tmp_path):
+    """Test that adding a shard moves only the users it now owns."""
+    for i in range(100):
+        authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+    before = {name: _usernames_in(path) for name, path in authenticator.shards.items()}
+
+    new_shard = str(tmp_path / "shard_new.db")
+    moved = authenticator.add_shard(new_shard)
+
+    assert moved == len(_usernames_in(new_shard)) > 0
+    assert len(authenticator) == 100
+    for name, usernames in before.items():
+        assert _usernames_in(authenticator.shards[name]) <= usernames
+    for i in range(100):
+        assert authenticator.authenticate(f"user_{i}", "example_password")
+    assert authenticator.rebalance() == 0
+
+
+def test_rebalance_keeps_same_username_across_tenants(tmp_path):
+    """Test that moving two tenants onto one shard keeps both of their users."""
+    authenticator = ShardedAuthenticator(db_paths={"s0": str(tmp_path / "s0.db")})
+    authenticator.import_user("john", HASHED_PASSWORD, tenant_id="t0")
+    authenticator.import_user("john", HASHED_PASSWORD, tenant_id="t6")
+    for i in range(1, 5):
+        authenticator.add_shard(str(tmp_path / f"s{i}.db"), name=f"s{i}")
+    for i in range(4, 0, -1):
+        authenticator.remove_shard(f"s{i}")
+    assert _users_in(str(tmp_path / "s0.db")) == {("t0", "john"), ("t6", "john")}
+    assert authenticator.authenticate("john", "example_password", "t0")
+    assert authenticator.authenticate("john", "example_password", "t6")
+    authenticator.close()
+
+
+def test_remove_shard(authenticator):
+    """Test that removing a shard moves its users and sessions to the others."""
+    for i in range(100):
+        authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+    name = authenticator.shard_for("user_0")
+    path = authenticator.shards[name]
+    _insert_rows(
+        path,
+        "INSERT INTO sessions (session_id, username) VALUES (?, ?)",
+        [("session_1", "user_0")],
+    )
+    moved = authenticator.remove_shard(name)
+
+    assert moved > 0
+    assert name not in authenticator.shards
+    assert _users_in(path) == set()
+    assert len(authenticator) == 100
+    assert "session_1" in _sessions_in(
+        authenticator.shards[authenticator.shard_for("user_0")]
+    )
+    for i in range(100):
+        assert authenticator.authenticate(f"user_{i}", "example_password")
+    with pytest.raises(ValueError):
+        authenticator.remove_shard(name)
+
+
+def test_rebalance_refuses_to_overwrite(authenticator):
+    """Test that a user already present on the target shard is never replaced."""
+    authenticator.import_user("john", HASHED_PASSWORD, tenant_id="acme")
+    owner = authenticator.shard_for("", "acme")
+    other = next(name for name in authenticator.shards if name != owner)
+    _insert_rows(
+        authenticator.shards[other],
+        "INSERT INTO users (username, hashed_password, tenant_id) VALUES (?, ?, ?)",
+        [("john", "stale_hash", "acme")],
+    )
+    with pytest.raises(sqlite3.IntegrityError):
+        authenticator.rebalance()
+    assert ("acme", "john") in _users_in(authenticator.shards[owner])
+    assert ("acme", "john") in _users_in(authenticator.shards[other])
+    assert authenticator.authenticate("john", "example_password", "acme")
+
+
+def test_rebalance_resumes_interrupted_move(authenticator, tmp_path):
+    """Test that a move interrupted between its copy and delete can be rerun."""
+    for i in range(50):
+        authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+    new_shard = str(tmp_path / "shard_new.db")
+    authenticator.add_shard(new_shard, rebalance=False)
+    username = next(
+        f"user_{i}"
+        for i in range(50)
+        if authenticator.shards[authenticator.shard_for(f"user_{i}")] == new_shard
+    )
+    # The state left behind when a move dies after copying the user
+    _insert_rows(
+        new_shard,
+        "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
+        [(username, HASHED_PASSWORD)],
+    )
+    assert len(authenticator) == 51
+
+    assert authenticator.rebalance() > 0
+    assert len(authenticator) == 50
+    assert _usernames_in(new_shard) == {
+        user["username"]
+        for user in authenticator.list_users()
+        if authenticator.shards[user["shard"]] == new_shard
+    }
+    assert authenticator.rebalance() == 0
+
+
+def test_add_shard_retries_after_interrupted_copy(authenticator, tmp_path):
+    """Test that copies left on a new shard by a crashed add do not block a retry."""
+    for i in range(50):
+        authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+    new_shard = str(tmp_path / "shard_new.db")
+    leftover = ShardedAuthenticator(db_paths=[new_shard])
+    for i in range(50):
+        leftover.import_user(f"user_{i}", HASHED_PASSWORD)
+    leftover.close()
+
+    assert authenticator.add_shard(new_shard) > 0
+    assert len(authenticator) == 50
+    for i in range(50):
+        assert authenticator.authenticate(f"user_{i}", "example_password")
+
+
+def test_rebalance_shards_ignores_path_spelling(shard_paths, tmp_path, monkeypatch):
+    """Test that relative and absolute paths name the same shards."""
+    monkeypatch.chdir(tmp_path)
+    relative = [f"shard_{i}.db" for i in range(3)]
+    authenticator = ShardedAuthenticator(db_paths=relative)
+    for i in range(100):
+        authenticator.import_user(f"user_{i}", HASHED_PASSWORD)
+    authenticator.close()
+    assert rebalance_shards(shard_paths) == 0
+    assert rebalance_shards(parse_shards([f"./{path}" for path in relative])) == 0
+
+
+def test_rebalance_shards_upgrades_legacy_database(tmp_path):
+    """Test that a BasicAuthenticator database can be split into shards."""
+    legacy = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(legacy)
+    conn.execute(
+        "CREATE TABLE users (username text PRIMARY KEY, hashed_password text)"
+    )
+    conn.execute("CREATE TABLE sessions (session_id text PRIMARY KEY)")
+    conn.executemany(
+        "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
+        [(f"user_{i}", HASHED_PASSWORD) for i in range(50)],
+    )
+    conn.commit()
+    conn.close()
+
+    new = str(tmp_path / "new.db")
+    moved = rebalance_shards({"legacy": legacy}, {"new": new})
+
+    assert moved == len(_usernames_in(new)) > 0
+    authenticator = ShardedAuthenticator(db_paths={"legacy": legacy, "new": new})
+    assert len(authenticator) == 50
+    assert authenticator.authenticate("user_0", "example_password")
+    authenticator.close()